@@ -1,25 +1,96 @@
 #!/usr/bin/env python3
 
 import argparse
-import configparser
+import atexit
+import io
+import re
 import subprocess
 import sys
 import os
-import pathlib # For path manipulation and home directory
+import stat
 # Removed urllib imports
 
 # --- Constants ---
 CONFIG_SECTION = "Markdown"
 # Keep the URL constant for the warning message
 DEFAULT_CONFIG_URL = "https://gist.githubusercontent.com/Reason0x6/7ac0814373f017c3ce4c04f1833e4a04/raw/1dd09da2c038862cf6dc5c16840dda85167d20e3/mddif_default_config"
+# Diffs at least this large are copied to the output from disk instead of being read into memory
+DIFF_SPILL_THRESHOLD = 10 * 1024 * 1024
+# Diffs over these limits are replaced by a one-line summary (0 disables a limit).
+# The byte cap is checked while the diff is streamed and git is stopped once it is passed,
+# so with the default cap nothing reaches DIFF_SPILL_THRESHOLD; spilling only comes into
+# play with --max-diff-bytes 0 or a cap above the threshold.
+DEFAULT_MAX_FILES = 50
+DEFAULT_MAX_DIFF_BYTES = 1024 * 1024
+# Each file's section of the diff is cut off after this many lines (0 disables)
+DEFAULT_MAX_LINES_PER_FILE = 300
+# Histogram is git's fast variant of patience diff (git commit 8c912eea, "teach --histogram
+# to diff"): it anchors on low-occurrence lines instead of Myers' O(ND) search, so it is
+# quicker on large or repetitive files and usually produces more readable hunks.
+DIFF_ALGORITHMS = ("myers", "minimal", "patience", "histogram")
+DEFAULT_DIFF_ALGORITHM = "histogram"
+# Skip 'git fetch origin' if this repo was fetched by mddif within this many seconds (0 always fetches)
+DEFAULT_FETCH_TTL = 300
 
 # --- Determine Default Config Path ---
-HOME_DIR = pathlib.Path.home()
-DEFAULT_CONFIG_DIR = HOME_DIR / "mddif"
-CONFIG_FILE_DEFAULT_PATH = DEFAULT_CONFIG_DIR / "diff_config.ini"
-CONFIG_FILE_DEFAULT = str(CONFIG_FILE_DEFAULT_PATH) # String version for argparse
+# Plain os.path strings; pathlib is only imported where its methods are needed
+HOME_DIR = os.path.expanduser("~")
+DEFAULT_CONFIG_DIR = os.path.join(HOME_DIR, "mddif")
+CONFIG_FILE_DEFAULT = os.path.join(DEFAULT_CONFIG_DIR, "diff_config.ini")
+# Parsed configs are cached here, keyed by the config file's mtime and size
+CACHE_DIR = os.path.join(HOME_DIR, ".cache", "mddif")
+# Bump whenever read_config's post-processing changes, so older cache entries are ignored
+CONFIG_CACHE_VERSION = 1
+
+# Environment for every git child process: no optional index-lock writes from read-only
+# commands, never block on a credential prompt, and untranslated (C locale) messages,
+# which also keeps the "not a git repository" check below language-independent
+GIT_ENV = {**os.environ, "GIT_OPTIONAL_LOCKS": "0", "GIT_TERMINAL_PROMPT": "0", "LC_ALL": "C"}
+
+# --- Cache Files ---
+def _path_hash(path):
+    """
+    Returns a stable 16-digit hex hash of the absolute path, for cache file names.
+    Plain-Python 64-bit FNV-1a: hashing one short string this way costs far less
+    than importing hashlib on every run.
+    """
+    digest = 0xCBF29CE484222325
+    for byte in os.fsencode(os.path.abspath(path)):
+        digest = ((digest ^ byte) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return f"{digest:016x}"
+
+# --- Status Output ---
+# Replaced in main() by a buffered stream so progress lines don't each cost a write + flush
+_STDERR = sys.stderr
+_QUIET = False
+
+def _open_buffered_stderr():
+    """
+    Returns a block-buffered text stream over the stderr file descriptor,
+    or sys.stderr itself if it has no usable descriptor.
+    closefd=False keeps the real stderr open when the stream is discarded.
+    """
+    try:
+        return open(sys.stderr.fileno(), "w", encoding=sys.stderr.encoding or "utf-8",
+                    errors="backslashreplace", closefd=False, buffering=io.DEFAULT_BUFFER_SIZE)
+    except (AttributeError, OSError, ValueError):
+        return sys.stderr
+
+def _progress(message):
+    """Prints a progress line unless --quiet was given."""
+    if not _QUIET: print(message, file=_STDERR)
 
 # --- Git Command Execution ---
+def _exit_if_not_a_repo(stderr_output):
+    """
+    Exits script if Git's stderr says it was not run inside a repository.
+    There is no separate rev-parse preflight; the first real git command
+    doubles as the check.
+    """
+    if stderr_output and "not a git repository" in stderr_output:
+        print("Error: Must be run inside a Git repository.", file=_STDERR)
+        sys.exit(1)
+
 def run_git_command(command, check=True):
     """
     Helper function to run a Git command and handle common errors.
@@ -27,44 +98,162 @@ def run_git_command(command, check=True):
     Exits script on failure if check=True.
     """
     try:
-        is_rev_parse_check = (len(command) > 2 and command[1] == "rev-parse" and command[2] == "--is-inside-work-tree")
-        if not is_rev_parse_check:
-             subprocess.run(
-                ["git", "rev-parse", "--is-inside-work-tree"],
-                check=True, text=True, stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
-            )
         result = subprocess.run(
-            command, check=check, capture_output=True, text=True, encoding="utf-8",
+            command, check=check, capture_output=True, text=True, encoding="utf-8", env=GIT_ENV,
         )
+        if result.returncode != 0: _exit_if_not_a_repo(result.stderr)
         return result.stdout
     except FileNotFoundError:
-        print("Error: 'git' command not found. Is Git installed?", file=sys.stderr)
+        print("Error: 'git' command not found. Is Git installed?", file=_STDERR)
         sys.exit(1)
     except subprocess.CalledProcessError as e:
         if check:
-            if "is-inside-work-tree" in str(e.cmd):
-                print("Error: Must be run inside a Git repository.", file=sys.stderr)
-            else:
-                print(f"Error running command: {' '.join(command)}", file=sys.stderr)
-                if e.stderr: print(f"Git stderr:\n{e.stderr.strip()}", file=sys.stderr)
+            _exit_if_not_a_repo(e.stderr)
+            print(f"Error running command: {' '.join(command)}", file=_STDERR)
+            if e.stderr: print(f"Git stderr:\n{e.stderr.strip()}", file=_STDERR)
             sys.exit(1)
         return None
     except Exception as e:
-        print(f"An unexpected error occurred running git: {e}", file=sys.stderr)
+        print(f"An unexpected error occurred running git: {e}", file=_STDERR)
         sys.exit(1)
     # This part is only reached if check=False and CalledProcessError occurred
     return None
 
+def stream_git_command(command, stdout=subprocess.PIPE, stderr=None, binary=False):
+    """
+    Starts a Git command whose stdout is read incrementally by the caller,
+    or written straight into the file object passed as stdout.
+    With binary=True the pipes carry raw bytes and nothing is decoded.
+    Returns the running Popen object; the caller must wait() on it and
+    check the return code once stdout has been consumed.
+    Exits script if Git cannot be started.
+    """
+    if stderr is None: _STDERR.flush() # Git shares our stderr; keep messages in order
+    try:
+        return subprocess.Popen(
+            command, stdout=stdout, stderr=stderr, bufsize=1024 * 1024,
+            text=not binary, encoding=None if binary else "utf-8", env=GIT_ENV,
+        )
+    except FileNotFoundError:
+        print("Error: 'git' command not found. Is Git installed?", file=_STDERR)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred running git: {e}", file=_STDERR)
+        sys.exit(1)
+
+def finish_git_stream(proc):
+    """
+    Waits for a streamed Git command to exit.
+    Exits script if the command failed (Git's own stderr is passed through).
+    """
+    if proc.stdout: proc.stdout.close()
+    if proc.wait() != 0:
+        print(f"Error running command: {' '.join(proc.args)}", file=_STDERR)
+        sys.exit(1)
+
 # --- Git Diff Logic ---
-def run_git_diff(target_branch):
+def fetch_stamp_path():
+    """
+    Returns the per-repository stamp file whose mtime records the last
+    successful fetch. It is keyed by the common git directory, so linked
+    worktrees (which share origin's refs) share one stamp.
+    """
+    git_common_dir = run_git_command(["git", "rev-parse", "--git-common-dir"]).strip()
+    return os.path.join(CACHE_DIR, f"fetch_{_path_hash(git_common_dir)}.stamp")
+
+def fetch_age(stamp_path):
+    """Returns seconds since the stamped fetch, or None if there is no stamp."""
+    import time # Only needed when a fetch stamp is used
+    try:
+        return time.time() - os.stat(stamp_path).st_mtime
+    except OSError:
+        return None
+
+def touch_fetch_stamp(stamp_path):
+    """Records a successful fetch, ignoring any failure to write the stamp."""
+    try:
+        os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+        with open(stamp_path, "a"): pass
+        os.utime(stamp_path)
+    except OSError:
+        pass
+
+def start_git_fetch():
+    """
+    Starts 'git fetch origin' in the background so it can overlap with
+    local work. Returns the running process for wait_git_fetch().
+    """
+    _progress("Fetching updates from origin...")
+    return stream_git_command(["git", "fetch", "origin"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def wait_git_fetch(fetch_proc):
     """
-    Fetches updates, checks if HEAD is behind the target, runs git diff,
-    and returns the diff output string or None if diff fails.
+    Waits for the background fetch to finish.
+    Exits script with Git's stderr if the fetch failed.
     """
-    print("Fetching updates from origin...", file=sys.stderr)
-    run_git_command(["git", "fetch", "origin"])
+    _, stderr_output = fetch_proc.communicate()
+    if fetch_proc.returncode != 0:
+        _exit_if_not_a_repo(stderr_output)
+        print(f"Error running command: {' '.join(fetch_proc.args)}", file=_STDERR)
+        if stderr_output: print(f"Git stderr:\n{stderr_output.strip()}", file=_STDERR)
+        sys.exit(1)
+
+class DiffHandle:
+    """
+    A git diff that has been written to a temporary file.
+    Small diffs are read back whole; spilled diffs are copied to the
+    output straight from disk. A handle without a path is an empty diff,
+    an omitted one if it carries a summary instead, or a deferred one if
+    it carries the git command to run straight into the output.
+    """
+    def __init__(self, path=None, summary=None, command=None):
+        self.path = path
+        self.summary = summary
+        self.command = command
+        self.size = os.path.getsize(path) if path else 0
+        self.is_spilled = self.size >= DIFF_SPILL_THRESHOLD
+
+    def cleanup(self):
+        """Removes the temporary file, if any."""
+        if self.path is None:
+            return
+        try: os.unlink(self.path)
+        except OSError: pass
 
-    print(f"Checking status relative to '{target_branch}'...", file=sys.stderr)
+def truncate_diff_lines(diff_lines, max_lines_per_file):
+    """
+    Yields diff lines (bytes), keeping at most max_lines_per_file lines of
+    each file's section (starting at its 'diff --git' header) and replacing
+    the rest of the section with a single truncation marker.
+    """
+    section_lines = 0
+    skipped_lines = 0
+    for line in diff_lines:
+        if line.startswith(b"diff --git "):
+            if skipped_lines: yield f"... [truncated, {skipped_lines} more lines] ...\n".encode("utf-8")
+            section_lines = skipped_lines = 0
+        if section_lines < max_lines_per_file:
+            section_lines += 1
+            yield line
+        else:
+            skipped_lines += 1
+    if skipped_lines: yield f"... [truncated, {skipped_lines} more lines] ...\n".encode("utf-8")
+
+def run_git_diff(target_branch, max_files=DEFAULT_MAX_FILES, max_diff_bytes=DEFAULT_MAX_DIFF_BYTES,
+                 max_lines_per_file=DEFAULT_MAX_LINES_PER_FILE, diff_algorithm=DEFAULT_DIFF_ALGORITHM,
+                 direct=False):
+    """
+    Checks if HEAD is behind the target, runs git diff into a temporary
+    file, and returns a DiffHandle for it. Expects origin to be fetched.
+    A cheap 'git diff --shortstat' runs first so empty diffs and diffs
+    touching more than max_files files skip the full diff. With
+    max_lines_per_file or max_diff_bytes set, the diff is streamed
+    through Python on its way to the file: truncate_diff_lines trims each
+    file, and git is stopped as soon as the output passes max_diff_bytes.
+    With direct set, the diff is not run here; the handle carries the
+    command instead.
+    """
+    _progress(f"Checking status relative to '{target_branch}'...")
     rev_list_command = ["git", "rev-list", "--left-right", "--count", f"HEAD...{target_branch}"]
     count_output = run_git_command(rev_list_command, check=False)
 
@@ -74,17 +263,147 @@ def run_git_diff(target_branch):
             if len(counts) == 2:
                 behind_count = int(counts[1])
                 if behind_count > 0:
-                    print(f"\n!!! WARNING: HEAD is behind '{target_branch}' by {behind_count} commit(s). !!!\n", file=sys.stderr)
-            else: print(f"Warning: Could not parse commit counts: '{count_output.strip()}'", file=sys.stderr)
-        except (ValueError, IndexError) as e: print(f"Warning: Error parsing commit counts '{count_output.strip()}': {e}", file=sys.stderr)
-    else: print(f"Warning: Could not determine relationship between HEAD and '{target_branch}'.", file=sys.stderr)
+                    print(f"\n!!! WARNING: HEAD is behind '{target_branch}' by {behind_count} commit(s). !!!\n", file=_STDERR)
+            else: print(f"Warning: Could not parse commit counts: '{count_output.strip()}'", file=_STDERR)
+        except (ValueError, IndexError) as e: print(f"Warning: Error parsing commit counts '{count_output.strip()}': {e}", file=_STDERR)
+    else: print(f"Warning: Could not determine relationship between HEAD and '{target_branch}'.", file=_STDERR)
 
-    print(f"Generating diff between '{target_branch}' and HEAD...", file=sys.stderr)
-    diff_command = ["git", "diff", f"{target_branch}..HEAD"]
-    diff_output = run_git_command(diff_command)
-    return diff_output
+    algorithm_option = f"--diff-algorithm={diff_algorithm}"
+    # git may be handed our TTY as stdout (the direct path), so never let it page or colour
+    diff_base = ["git", "--no-pager", "diff", "--no-color", algorithm_option]
+    shortstat = run_git_command([*diff_base, "--shortstat", f"{target_branch}..HEAD"]).strip()
+    if not shortstat:
+        return DiffHandle()
+    files_match = re.match(r"(\d+) files? changed", shortstat)
+    if max_files and files_match and int(files_match.group(1)) > max_files:
+        print(f"Info: Diff touches more than {max_files} files; writing a summary instead.", file=_STDERR)
+        return DiffHandle(summary=f"*(Diff omitted: {shortstat}. Exceeds the limit of {max_files} files; raise it with --max-files.)*")
+
+    _progress(f"Generating diff between '{target_branch}' and HEAD...")
+    diff_command = [*diff_base, f"{target_branch}..HEAD"]
+    if direct:
+        return DiffHandle(command=diff_command)
+    import tempfile # Only needed when the diff goes through a temporary file
+    diff_file = tempfile.NamedTemporaryFile(mode="w+b", delete=False, prefix="mddif-", suffix=".diff")
+    too_large = False
+    try:
+        with diff_file:
+            if max_lines_per_file or max_diff_bytes:
+                diff_proc = stream_git_command(diff_command, binary=True)
+                diff_lines = diff_proc.stdout
+                if max_lines_per_file: diff_lines = truncate_diff_lines(diff_lines, max_lines_per_file)
+                written = 0
+                for line in diff_lines:
+                    written += len(line)
+                    if max_diff_bytes and written > max_diff_bytes:
+                        too_large = True
+                        break
+                    diff_file.write(line)
+                if too_large:
+                    # No need for the rest of the diff; stop git instead of letting it finish
+                    diff_proc.kill()
+                    diff_proc.stdout.close()
+                    diff_proc.wait()
+                else:
+                    finish_git_stream(diff_proc)
+            else:
+                finish_git_stream(stream_git_command(diff_command, stdout=diff_file, binary=True))
+    except BaseException:
+        os.unlink(diff_file.name)
+        raise
+    diff_handle = DiffHandle(diff_file.name)
+    if too_large:
+        diff_handle.cleanup()
+        print(f"Info: Diff is larger than {max_diff_bytes} bytes; writing a summary instead.", file=_STDERR)
+        return DiffHandle(summary=f"*(Diff omitted: {shortstat}. Exceeds the limit of {max_diff_bytes} bytes; raise it with --max-diff-bytes.)*")
+    return diff_handle
 
 # --- Config Reading (Modified) ---
+def _fast_read_config(config_path):
+    """
+    Reads prepend_text/append_text from the config section without configparser.
+    Every line of the file is checked with configparser's rules for comments,
+    section headers, indented continuation lines and blank lines inside values.
+    Returns None if anything would make configparser fail or read the file
+    differently (so it can handle or report it), else a dict of raw values.
+    """
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            data = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    sections = {}
+    options = None # Options of the current section
+    option = None
+    option_indent = 0
+    for line in data.split("\n"):
+        stripped = line.strip()
+        if stripped.startswith(("#", ";")): continue
+        if not stripped:
+            if option: options[option].append("")
+            continue
+        indent = re.search(r"\S", line).start()
+        if option and indent > option_indent:
+            options[option].append(stripped)
+            continue
+        header_match = re.match(r"\[(.+)\]", stripped)
+        if header_match:
+            name = header_match.group(1)
+            if name in sections or name == "DEFAULT":
+                return None # Duplicate or DEFAULT section; let configparser handle it
+            options = sections[name] = {}
+            option = None
+            continue
+        option_match = re.match(r"([^=:]+?)\s*[=:]\s*(.*)$", stripped)
+        if options is None or option_match is None:
+            return None # Option before any header, or an unparseable line
+        option = option_match.group(1).lower()
+        if option in options:
+            return None # Duplicate option; let configparser report it
+        options[option] = [option_match.group(2).strip()]
+        option_indent = indent
+
+    section = sections.get(CONFIG_SECTION, {})
+    values = {key: "\n".join(section[key]).strip() for key in ("prepend_text", "append_text") if key in section}
+    if any("%" in value for value in values.values()):
+        return None # Needs configparser's interpolation
+    return values
+
+# The cache holds a tuple of plain strings, so it is stored with marshal: unlike pickle
+# (about 3 ms to import) it is already loaded by the interpreter, which keeps a cache hit
+# cheaper than simply re-parsing the INI.
+def _config_cache_path(config_path):
+    """Returns the cache file used for the given config file."""
+    return os.path.join(CACHE_DIR, f"config_{_path_hash(config_path)}.cache")
+
+def _load_config_cache(cache_path, cache_key):
+    """Returns the cached (prepend, append) tuple, or None if missing or stale."""
+    import marshal # Already loaded by the interpreter; costs nothing
+    try:
+        with open(cache_path, "rb") as f:
+            key, prepend_text, append_text = marshal.load(f)
+    except Exception:
+        return None # Missing or unreadable cache; just parse the config
+    if key != cache_key:
+        return None
+    return prepend_text, append_text
+
+def _store_config_cache(cache_path, cache_key, prepend_text, append_text):
+    """Atomically writes the parsed config to the cache, ignoring any failure."""
+    import marshal # Already loaded by the interpreter; costs nothing
+    tmp_name = None
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_name = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_name, "wb") as f:
+            marshal.dump((cache_key, prepend_text, append_text), f)
+        os.replace(tmp_name, cache_path)
+    except Exception:
+        if tmp_name:
+            try: os.unlink(tmp_name)
+            except OSError: pass
+
 def read_config(config_path):
     """
     Reads prepend/append text from the config file.
@@ -93,50 +412,113 @@ def read_config(config_path):
     """
     prepend_text = ""
     append_text = ""
-    config_path_obj = pathlib.Path(config_path).expanduser()
+    config_path = os.path.expanduser(config_path)
+    # One stat serves both the existence check and the cache key below
+    try:
+        st = os.stat(config_path)
+        config_exists = stat.S_ISREG(st.st_mode)
+    except OSError:
+        config_exists = False
 
-    if not config_path_obj.is_file():
+    if not config_exists:
         # Check if the missing file is the default one
-        if str(config_path_obj) == CONFIG_FILE_DEFAULT:
-            # Print specific warning for missing default config
-            print(f"\n--- Configuration Warning ---", file=sys.stderr)
-            print(f"Default config file not found at: {config_path_obj}", file=sys.stderr)
-            print(f"To use a default template, download it from:", file=sys.stderr)
-            print(f"  {DEFAULT_CONFIG_URL}", file=sys.stderr)
-            print(f"and place it as '{config_path_obj.name}' in the directory:", file=sys.stderr)
-            print(f"  {config_path_obj.parent}", file=sys.stderr)
-            print(f"You may need to create the directory first.", file=sys.stderr)
-            print(f"Proceeding with no prepend/append text.", file=sys.stderr)
-            print(f"-----------------------------\n", file=sys.stderr)
+        if config_path == CONFIG_FILE_DEFAULT:
+            # Print specific warning for missing default config (one write instead of a print per line)
+            _STDERR.write(
+                f"\n--- Configuration Warning ---\n"
+                f"Default config file not found at: {config_path}\n"
+                f"To use a default template, download it from:\n"
+                f"  {DEFAULT_CONFIG_URL}\n"
+                f"and place it as '{os.path.basename(config_path)}' in the directory:\n"
+                f"  {os.path.dirname(config_path)}\n"
+                f"You may need to create the directory first.\n"
+                f"Proceeding with no prepend/append text.\n"
+                f"-----------------------------\n\n"
+            )
         else:
             # Generic message if a user-specified file via -c is missing
-             print(f"Info: Specified config file '{config_path_obj}' not found. Using defaults.", file=sys.stderr)
+             print(f"Info: Specified config file '{config_path}' not found. Using defaults.", file=_STDERR)
         # Return empty strings as no config was loaded
         return prepend_text, append_text
 
-    # Proceed if file exists
-    config = configparser.ConfigParser()
-    try:
-        config.read(config_path_obj, encoding='utf-8')
-        if CONFIG_SECTION in config:
-            prepend_text = config[CONFIG_SECTION].get("prepend_text", "").strip()
-            append_text = config[CONFIG_SECTION].get("append_text", "").strip()
-            if prepend_text: prepend_text += "\n\n"
-            if append_text: append_text = "\n\n" + append_text
-    except configparser.Error as e:
-        print(f"Error reading config file '{config_path_obj}': {e}", file=sys.stderr)
-        # Continue with empty defaults if config is broken
+    # Proceed if file exists, reusing the cached result if it is unchanged
+    # The path guards against hash collisions between config files sharing a cache name
+    cache_key = f"{CONFIG_CACHE_VERSION}:{st.st_mtime_ns}-{st.st_size}:{os.path.abspath(config_path)}"
+    cache_path = _config_cache_path(config_path)
+    cached = _load_config_cache(cache_path, cache_key)
+    if cached is not None:
+        return cached
+
+    values = _fast_read_config(config_path)
+    if values is None:
+        import configparser # Only needed when the fast reader gives up
+        config = configparser.ConfigParser()
+        try:
+            config.read(config_path, encoding='utf-8')
+            values = config[CONFIG_SECTION] if CONFIG_SECTION in config else {}
+            values = {key: values.get(key, "") for key in ("prepend_text", "append_text")}
+        except configparser.Error as e:
+            print(f"Error reading config file '{config_path}': {e}", file=_STDERR)
+            # Continue with empty defaults if config is broken (not cached, so the error shows every run)
+            values = None
 
+    if values is None:
+        return prepend_text, append_text
+
+    prepend_text = values.get("prepend_text", "").strip()
+    append_text = values.get("append_text", "").strip()
+    if prepend_text: prepend_text += "\n\n"
+    if append_text: append_text = "\n\n" + append_text
+
+    _store_config_cache(cache_path, cache_key, prepend_text, append_text)
     return prepend_text, append_text
 
 # --- Markdown Formatting ---
-def format_markdown(diff_output, prepend_text, append_text):
-    """Formats the diff output into Markdown."""
-    if not diff_output or not diff_output.strip():
-        diff_block = "*(No differences found between specified refs)*"
+def write_markdown(out, diff_handle, prepend_text, append_text):
+    """
+    Writes the diff wrapped in Markdown to the binary file object out.
+    The diff stays as the bytes git produced and only the surrounding text
+    is encoded. Spilled diffs are copied across with shutil.copyfileobj
+    rather than concatenated in memory; deferred diffs are written into
+    out by git itself, so the diff body never passes through Python at all.
+    """
+    out.write(prepend_text.encode("utf-8"))
+    if diff_handle.summary:
+        out.write(diff_handle.summary.encode("utf-8"))
+    elif diff_handle.command:
+        out.write(b"```diff\n")
+        out.flush() # git writes to the same file descriptor
+        finish_git_stream(stream_git_command(diff_handle.command, stdout=out, binary=True))
+        out.write(b"```")
+    elif diff_handle.size == 0:
+        out.write(b"*(No differences found between specified refs)*")
     else:
-        diff_block = f"```diff\n{diff_output.strip()}\n```"
-    return f"{prepend_text}{diff_block}{append_text}"
+        out.write(b"```diff\n")
+        with open(diff_handle.path, "rb") as diff_file:
+            if diff_handle.is_spilled:
+                import shutil # Only needed for spilled diffs
+                shutil.copyfileobj(diff_file, out)
+            else: out.write(diff_file.read())
+        out.write(b"```")
+    out.write(append_text.encode("utf-8"))
+
+def _non_negative_int(value):
+    """argparse type for the size limits, where 0 means no limit."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: '{value}'")
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {number}")
+    return number
+
+def _has_fileno(stream):
+    """Returns True if stream is backed by an OS file descriptor git can write to."""
+    try:
+        stream.fileno()
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False
 
 # --- Main Execution (Modified) ---
 def main():
@@ -145,49 +527,105 @@ def main():
         formatter_class=argparse.RawTextHelpFormatter
     )
     branch_group = parser.add_mutually_exclusive_group(required=True)
-    branch_group.add_argument("-m", "--master", action="store_true", help="Compare HEAD against origin/master.")
-    branch_group.add_argument("-rc", "--release-candidate", action="store_true", help="Compare HEAD against origin/Release-Candidate.")
-    branch_group.add_argument("-b", "--branch", metavar="BRANCH_OR_REF", help="Compare HEAD against the specified ref.")
+    # All three flags store straight into args.target_branch, so no branch chain is needed afterwards
+    branch_group.add_argument("-m", "--master", dest="target_branch", action="store_const", const="origin/master", help="Compare HEAD against origin/master.")
+    branch_group.add_argument("-rc", "--release-candidate", dest="target_branch", action="store_const", const="origin/Release-Candidate", help="Compare HEAD against origin/Release-Candidate.")
+    branch_group.add_argument("-b", "--branch", dest="target_branch", metavar="BRANCH_OR_REF", help="Compare HEAD against the specified ref.")
     parser.add_argument("-o", "--output", metavar="FILE", help="Output file path. Prints to stdout if not specified.")
     parser.add_argument("-c", "--config", metavar="FILE", default=CONFIG_FILE_DEFAULT, help=f"Path to config file.\n(Default: {CONFIG_FILE_DEFAULT})")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Suppress progress messages; warnings and errors are still shown.")
+    parser.add_argument("--no-fetch", action="store_true", help="Do not run 'git fetch origin'; diff against the refs as they are.")
+    parser.add_argument("--fetch-ttl", metavar="SECONDS", type=_non_negative_int, default=DEFAULT_FETCH_TTL, help=f"Skip the fetch if this repo was fetched less than SECONDS ago.\n0 always fetches. (Default: {DEFAULT_FETCH_TTL})")
+    parser.add_argument("--diff-algorithm", choices=DIFF_ALGORITHMS, default=DEFAULT_DIFF_ALGORITHM, help=f"Diff algorithm passed to git diff. (Default: {DEFAULT_DIFF_ALGORITHM})")
+    parser.add_argument("--max-files", metavar="N", type=_non_negative_int, default=DEFAULT_MAX_FILES, help=f"Summarise instead of diffing when more than N files changed.\n0 disables the limit. (Default: {DEFAULT_MAX_FILES})")
+    parser.add_argument("--max-lines-per-file", metavar="N", type=_non_negative_int, default=DEFAULT_MAX_LINES_PER_FILE, help=f"Truncate each file's part of the diff after N lines.\n0 disables truncation. (Default: {DEFAULT_MAX_LINES_PER_FILE})")
+    parser.add_argument("--max-diff-bytes", metavar="BYTES", type=_non_negative_int, default=DEFAULT_MAX_DIFF_BYTES, help=f"Summarise instead of diffing when the diff exceeds BYTES.\n0 disables the limit. (Default: {DEFAULT_MAX_DIFF_BYTES})")
 
     args = parser.parse_args()
 
+    global _STDERR, _QUIET
+    _QUIET = args.quiet
+    _STDERR = _open_buffered_stderr()
+    atexit.register(_STDERR.flush) # Also covers the sys.exit() error paths
+
     # --- Removed default directory creation block ---
 
-    # Determine target branch
-    target_branch = None
-    if args.master: target_branch = "origin/master"
-    elif args.release_candidate: target_branch = "origin/Release-Candidate"
-    elif args.branch: target_branch = args.branch
+    target_branch = args.target_branch
 
     # Core Logic
+    # The fetch is network-bound, so read the config while it runs
+    fetch_proc = None
+    fetch_stamp = None
+    if not args.no_fetch:
+        # With --fetch-ttl 0 the stamp is never consulted, so don't spend a git process finding it
+        if args.fetch_ttl: fetch_stamp = fetch_stamp_path()
+        last_fetch_age = fetch_age(fetch_stamp) if fetch_stamp else None
+        if last_fetch_age is not None and last_fetch_age < args.fetch_ttl:
+            _progress(f"Skipping fetch: origin was fetched {int(last_fetch_age)}s ago (--fetch-ttl {args.fetch_ttl}).")
+        else:
+            fetch_proc = start_git_fetch()
     # read_config now handles the warning if default is missing
     prepend_text, append_text = read_config(args.config)
-    diff_output = run_git_diff(target_branch)
-    markdown_content = format_markdown(diff_output, prepend_text, append_text)
+    if fetch_proc:
+        _STDERR.flush() # Show what we have so far while waiting on the network
+        wait_git_fetch(fetch_proc)
+        if fetch_stamp: touch_fetch_stamp(fetch_stamp)
+    # With no truncation or size cap nothing needs to see the diff, so git can write the
+    # output file, or our stdout if it is a real descriptor, itself
+    direct = not args.max_lines_per_file and not args.max_diff_bytes and (bool(args.output) or _has_fileno(sys.stdout))
+    diff_handle = run_git_diff(target_branch, args.max_files, args.max_diff_bytes, args.max_lines_per_file,
+                               args.diff_algorithm, direct)
 
     # Output Handling
-    if args.output:
-        try:
-            output_path_obj = pathlib.Path(args.output)
-            output_dir = output_path_obj.parent
-            if not output_dir.exists():
-                 print(f"Info: Creating output directory: {output_dir}", file=sys.stderr)
-                 output_dir.mkdir(parents=True, exist_ok=True)
-            with output_path_obj.open("w", encoding="utf-8") as f:
-                f.write(markdown_content)
-            print(f"Markdown diff successfully written to '{args.output}'", file=sys.stderr)
+    _STDERR.flush() # Warnings and progress describe the document, so they go out before it
+    try:
+        if args.output:
+            import pathlib # Only needed to build the file link
             try:
-                absolute_path = output_path_obj.resolve(strict=True)
-                file_uri = absolute_path.as_uri()
-                print(f"Link: {file_uri}", file=sys.stderr)
-            except Exception as path_e: print(f"(Warning: Could not generate clickable link: {path_e})", file=sys.stderr)
-        except (IOError, OSError) as e:
-            print(f"Error writing output file/directory '{args.output}': {e}", file=sys.stderr)
-            sys.exit(1)
-    else:
-        print(markdown_content)
+                output_dir = os.path.dirname(args.output)
+                if output_dir and not os.path.isdir(output_dir):
+                     print(f"Info: Creating output directory: {output_dir}", file=_STDERR)
+                     os.makedirs(output_dir, exist_ok=True)
+                # Write beside the target and rename on success, so a failed git diff
+                # (e.g. while writing straight into the file) never leaves a partial report.
+                # The real path keeps a symlinked -o pointing at the report, and an existing
+                # report keeps its mode (and ownership, where we are allowed to set it).
+                real_output = os.path.realpath(args.output)
+                tmp_output = f"{real_output}.{os.getpid()}.tmp"
+                try:
+                    # A large buffer keeps write() syscalls down for multi-MB diffs
+                    with open(tmp_output, "wb", buffering=1024 * 1024) as f:
+                        write_markdown(f, diff_handle, prepend_text, append_text)
+                    try:
+                        existing = os.stat(real_output)
+                    except FileNotFoundError:
+                        existing = None
+                    if existing is not None:
+                        os.chmod(tmp_output, stat.S_IMODE(existing.st_mode))
+                        if hasattr(os, "chown"):
+                            try: os.chown(tmp_output, existing.st_uid, existing.st_gid)
+                            except OSError: pass
+                    os.replace(tmp_output, real_output)
+                except BaseException:
+                    try: os.unlink(tmp_output)
+                    except OSError: pass
+                    raise
+                success_message = f"Markdown diff successfully written to '{args.output}'\n"
+                try:
+                    # abspath is enough for a link; resolve(strict=True) would stat every path component
+                    file_uri = pathlib.Path(os.path.abspath(args.output)).as_uri()
+                    success_message += f"Link: {file_uri}\n"
+                except Exception as path_e: success_message += f"(Warning: Could not generate clickable link: {path_e})\n"
+                if not _QUIET: _STDERR.write(success_message)
+            except (IOError, OSError) as e:
+                print(f"Error writing output file/directory '{args.output}': {e}", file=_STDERR)
+                sys.exit(1)
+        else:
+            sys.stdout.flush()
+            write_markdown(sys.stdout.buffer, diff_handle, prepend_text, append_text)
+            sys.stdout.buffer.write(b"\n")
+    finally:
+        diff_handle.cleanup()
 
 if __name__ == "__main__":
     main()